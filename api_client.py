@@ -1,21 +1,36 @@
-import http.server
-from http.server import SimpleHTTPRequestHandler
-from socketserver import TCPServer
-from functools import partial
+import os
+import sys
+import uvicorn
+from fastapi import FastAPI
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.staticfiles import StaticFiles
 
-class CORSRequestHandler(SimpleHTTPRequestHandler):
-    def end_headers(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
-        super().end_headers()
+PORT = 3004
+CLIENT_DIR = os.path.join(os.path.dirname(__file__), "client")
+
+# StaticFiles sirve los assets en paralelo desde el event loop (sin un hilo
+# bloqueante por petición como SimpleHTTPRequestHandler).
+app = FastAPI()
+
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_credentials=False,
+    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_headers=["Content-Type"],
+)
+
+app.mount("/", StaticFiles(directory=CLIENT_DIR, html=True), name="client")
 
 def run_server():
-    PORT = 3004
-    handler = partial(CORSRequestHandler, directory="client")
-    with TCPServer(("", PORT), handler) as httpd:
-        print(f"Serving on port {PORT}")
-        httpd.serve_forever()
+    print(f"Serving on port {PORT}")
+    uvicorn.run(
+        app,
+        host="0.0.0.0",
+        port=PORT,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools"
+    )
 
 if __name__ == "__main__":
     run_server()
@@ -1,9 +1,12 @@
 # main.py (Tu API en el puerto 3000)
 
+import os
+import logging
 import httpx
 from fastapi import FastAPI, Request, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
 
 # --- CONFIGURACIÓN ---
 
@@ -18,6 +21,16 @@ MODEL="openai/gpt-4.1"
 # No uses la "Bearer 2412" de tu ejemplo, usa tu clave real.
 API_KEY = "sk-xxxxxxxxxxxxxxxxxxxxxxxxxxxx" 
 
+# Log del proxy; los cuerpos de las peticiones solo se vuelcan en DEBUG.
+# Handler propio para que se vea también al lanzarlo con `uvicorn api_llm:app`.
+logger = logging.getLogger("llm_proxy")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s: %(message)s"))
+    logger.addHandler(_log_handler)
+logger.setLevel(os.environ.get("LLM_LOG_LEVEL", "INFO"))
+logger.propagate = False
+
 # Orígenes permitidos (tu frontend)
 origins = ["*"]
 
@@ -29,13 +42,24 @@ app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
-    allow_credentials=True,
+    allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
 )
 
-# Creamos un cliente HTTP que reutilizaremos
-client = httpx.AsyncClient()
+# Creamos un cliente HTTP que reutilizaremos: pool acotado con keep-alive y
+# HTTP/2 (requiere `pip install "httpx[http2]"`) para no repetir el
+# handshake TCP/TLS en cada llamada al LLM.
+client = httpx.AsyncClient(
+    http2=True,
+    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0),
+    timeout=httpx.Timeout(60.0, connect=5.0)  # 60 segundos, 5 para conectar
+)
+
+
+@app.on_event("shutdown")
+async def close_client():
+    await client.aclose()
 
 @app.post("/v1/chat/completions")
 async def proxy_chat_completions(request: Request):
@@ -43,11 +67,11 @@ async def proxy_chat_completions(request: Request):
     Esta ruta recibe la petición de tu frontend,
     le añade la API key real, y la reenvía a la API de OpenAI.
     """
-    print("[Proxy] Nueva petición de chat/completions recibida")
-    print("[Proxy] Datos recibidos:", await request.json())
+    logger.info("[Proxy] Nueva petición de chat/completions recibida")
     try:
         # 1. Lee el JSON que envió tu frontend
         data = await request.json()
+        logger.debug("[Proxy] Datos recibidos: %s", data)
 
         # 2. Prepara las cabeceras para la API REAL
         headers = {
@@ -55,15 +79,31 @@ async def proxy_chat_completions(request: Request):
             "Authorization": f"Bearer {API_KEY}"  # ¡Usamos la clave secreta!
         }
 
-        # 3. Llama a la API real del LLM
+        # 3. Si el frontend pidió "stream": true, reenvía los chunks SSE según
+        #    llegan (el primer token no espera a la generación completa).
+        #    La respuesta se cierra cuando termina el StreamingResponse.
+        if data.get("stream"):
+            upstream = client.build_request("POST", REAL_LLM_API_URL, json=data, headers=headers)
+            response = await client.send(upstream, stream=True)
+            if response.is_error:
+                await response.aread()
+                await response.aclose()
+                return JSONResponse(content=response.json(), status_code=response.status_code)
+            return StreamingResponse(
+                response.aiter_bytes(),
+                status_code=response.status_code,
+                media_type=response.headers.get("content-type", "text/event-stream"),
+                background=BackgroundTask(response.aclose)
+            )
+
+        # 4. Llama a la API real del LLM
         response = await client.post(
             REAL_LLM_API_URL,
             json=data,
-            headers=headers,
-            timeout=60.0  # Damos un timeout de 60 segundos
+            headers=headers
         )
 
-        # 4. Devuelve la respuesta exacta del LLM al frontend
+        # 5. Devuelve la respuesta exacta del LLM al frontend
         response.raise_for_status()  # Lanza un error si la API del LLM falló
         return JSONResponse(content=response.json(), status_code=response.status_code)
 
@@ -78,4 +118,4 @@ async def proxy_chat_completions(request: Request):
 def read_root():
     return {"status": "Proxy de FastAPI para LLM está corriendo"}
 
-# run: uvicorn api_llm:app --host 0.0.0.0 --port 3001
\ No newline at end of file
+# run: uvicorn api_llm:app --host 0.0.0.0 --port 3001 --loop uvloop --http httptools
\ No newline at end of file
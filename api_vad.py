@@ -1,13 +1,28 @@
 '''
-install torch with cuda
-pip install torch --index-url https://download.pytorch.org/whl/cu121
-pip install torchaudio --index-url https://download.pytorch.org/whl/cu121
+Silero VAD sobre ONNX Runtime (sin PyTorch)
+pip install onnxruntime numpy
+
+Descargar el modelo int8 (QInt8 simétrico por canal, ~208KB) en models/silero_vad.int8.onnx:
+https://github.com/k2-fsa/sherpa-onnx/releases/download/asr-models/silero_vad.int8.onnx
+Si no existe se usa el modelo FP32 models/silero_vad.onnx:
+https://github.com/snakers4/silero-vad/raw/master/src/silero_vad/data/silero_vad.onnx
+No usar variantes QUInt8: son mucho más lentas en ONNX Runtime CPU.
+
+Backend OpenVINO (CPUs Intel con AVX-512 VNNI), VAD_BACKEND=openvino:
+pip install openvino
+El ONNX general no convierte en OpenVINO; usar la variante silero_vad_openvino_16k.onnx
+(entradas input/state, sin sr) del paquete silero-vad y convertirla a IR:
+ovc models/silero_vad_openvino_16k.onnx --output_model models/silero_vad.xml
 '''
 
 
+import os
+import sys
+import queue
+import logging
 import uvicorn
-import torch
 import numpy as np
+import onnxruntime as ort
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -15,6 +30,17 @@ from fastapi.middleware.cors import CORSMiddleware
 app = FastAPI()
 VAD_PORT = 8001
 
+# Los eventos por chunk van a logging (formateo perezoso) en lugar de print(),
+# que toma el lock de stdout en pleno bucle de audio. El handler se configura
+# aquí (no en __main__) para que también salga con `uvicorn api_vad:app`.
+logger = logging.getLogger("vad")
+if not logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter("%(levelname)s:%(name)s: %(message)s"))
+    logger.addHandler(_log_handler)
+logger.setLevel(os.environ.get("VAD_LOG_LEVEL", "INFO"))
+logger.propagate = False
+
 # --- CORRECCIÓN 1 (Fatal) ---
 # El modelo Silero VAD, con un sample rate de 16kHz, espera
 # chunks de exactamente 512 muestras. El valor anterior (1536) era incorrecto.
@@ -22,27 +48,307 @@ VAD_CHUNK_SIZE = 512
 VAD_SAMPLE_RATE = 16000 # El modelo Silero VAD espera 16kHz
 # --- FIN DE LA CORRECCIÓN 1 ---
 
+# Silero v5 necesita las últimas 64 muestras del chunk anterior como contexto
+VAD_CONTEXT_SIZE = 64
+VAD_THRESHOLD = 0.5
+# Capacidad del ring buffer de audio por conexión (en muestras)
+VAD_RING_SIZE = 8192
+# Formato de las muestras que envía el cliente por el WebSocket:
+# "int16" (PCM16, la mitad de ancho de banda) o "float32" (clientes antiguos)
+VAD_INPUT_FORMAT = os.environ.get("VAD_INPUT_FORMAT", "int16")
+PCM16_SCALE = np.float32(1.0 / 32768.0)
+
+BASE_DIR = os.path.dirname(__file__)
+VAD_MODEL_INT8_PATH = os.path.join(BASE_DIR, "models", "silero_vad.int8.onnx")
+VAD_MODEL_FP32_PATH = os.path.join(BASE_DIR, "models", "silero_vad.onnx")
+VAD_MODEL_PATH = os.environ.get(
+    "VAD_MODEL_PATH",
+    VAD_MODEL_INT8_PATH if os.path.exists(VAD_MODEL_INT8_PATH) else VAD_MODEL_FP32_PATH
+)
+# Firma de entrada esperada (Silero v5); el modelo int8 debe ser idéntico
+VAD_MODEL_INPUTS = {"input", "state", "sr"}
+
+# Backend de inferencia: "onnxruntime" (por defecto) u "openvino"
+VAD_BACKEND = os.environ.get("VAD_BACKEND", "onnxruntime")
+VAD_OPENVINO_XML_PATH = os.path.join(BASE_DIR, "models", "silero_vad.xml")
+VAD_OPENVINO_PATH = os.environ.get(
+    "VAD_OPENVINO_PATH",
+    VAD_OPENVINO_XML_PATH if os.path.exists(VAD_OPENVINO_XML_PATH)
+    else os.path.join(BASE_DIR, "models", "silero_vad_openvino_16k.onnx")
+)
+VAD_OPENVINO_INPUTS = {"input", "state"}
+
+
+class AudioRingBuffer:
+    """
+    Ring buffer preallocado de float32. Cada escritura copia solo las muestras
+    nuevas; la lectura devuelve una vista contigua (copia solo si da la vuelta).
+    """
+
+    def __init__(self, capacity=VAD_RING_SIZE, chunk_size=VAD_CHUNK_SIZE):
+        self.ring = np.empty(capacity, dtype=np.float32)
+        self.ring_bytes = self.ring.view(np.uint8)
+        self.scratch = np.empty(chunk_size, dtype=np.float32)
+        self.capacity = capacity
+        self.write_idx = 0
+        self.read_idx = 0
+        self.count = 0
+
+    def _reserve(self, n):
+        """Reserva n muestras y devuelve (posición de escritura, muestras hasta el final del ring)."""
+        # Si no cabe, se descartan las muestras más antiguas
+        overflow = self.count + n - self.capacity
+        if overflow > 0:
+            self.read_idx = (self.read_idx + overflow) % self.capacity
+            self.count -= overflow
+        start = self.write_idx
+        self.write_idx = (start + n) % self.capacity
+        self.count += n
+        return start, min(n, self.capacity - start)
+
+    def write(self, samples):
+        n = len(samples)
+        if n > self.capacity:
+            samples = samples[-self.capacity:]
+            n = self.capacity
+        start, first = self._reserve(n)
+        self.ring[start:start + first] = samples[:first]
+        if first < n:
+            self.ring[:n - first] = samples[first:]
+
+    def write_bytes(self, data):
+        """
+        Copia un payload de float32 crudos directamente al ring (un único memcpy,
+        sin array intermedio ni .copy()).
+        """
+        itemsize = self.ring.itemsize
+        if len(data) % itemsize:
+            raise ValueError(f"el tamaño del payload ({len(data)}) no es múltiplo de {itemsize}")
+        src = memoryview(data)
+        n = len(data) // itemsize
+        if n > self.capacity:
+            src = src[-self.capacity * itemsize:]
+            n = self.capacity
+        start, first = self._reserve(n)
+        self.ring_bytes[start * itemsize:(start + first) * itemsize] = src[:first * itemsize]
+        if first < n:
+            self.ring_bytes[:(n - first) * itemsize] = src[first * itemsize:]
+
+    def write_pcm16(self, data):
+        """
+        Escribe un payload PCM16 convirtiéndolo a float32 directamente sobre el
+        ring (cast + escala en una sola operación, sin array intermedio).
+        """
+        if len(data) % 2:
+            raise ValueError(f"el tamaño del payload ({len(data)}) no es múltiplo de 2")
+        src = np.frombuffer(data, dtype=np.int16)
+        n = len(src)
+        if n > self.capacity:
+            src = src[-self.capacity:]
+            n = self.capacity
+        start, first = self._reserve(n)
+        np.multiply(src[:first], PCM16_SCALE, out=self.ring[start:start + first], dtype=np.float32)
+        if first < n:
+            np.multiply(src[first:], PCM16_SCALE, out=self.ring[:n - first], dtype=np.float32)
+
+    def read(self, n):
+        """Consume n muestras. La vista es válida hasta la siguiente escritura."""
+        start = self.read_idx
+        end = start + n
+        if end <= self.capacity:
+            out = self.ring[start:end]
+        else:
+            first = self.capacity - start
+            out = self.scratch[:n]
+            out[:first] = self.ring[start:]
+            out[first:] = self.ring[:n - first]
+        self.read_idx = end % self.capacity
+        self.count -= n
+        return out
+
+    def reset(self):
+        self.write_idx = 0
+        self.read_idx = 0
+        self.count = 0
+
+
+class VADIterator:
+    """
+    Reimplementación del VADIterator de silero-vad, independiente del runtime.
+    Mantiene el contexto entre chunks de 512 muestras y la máquina de estados
+    speech_start / speech_end; las subclases implementan _infer().
+    """
+
+    def __init__(self, threshold=0.5, sampling_rate=16000,
+                 min_silence_duration_ms=100, speech_pad_ms=30):
+        self.threshold = threshold
+        self.sampling_rate = sampling_rate
+        self.min_silence_samples = sampling_rate * min_silence_duration_ms / 1000
+        self.speech_pad_samples = sampling_rate * speech_pad_ms / 1000
+        self.input = np.zeros((1, VAD_CONTEXT_SIZE + VAD_CHUNK_SIZE), dtype=np.float32)
+        self.reset_states()
+
+    def _infer(self):
+        """Ejecuta el modelo sobre self.input y devuelve la probabilidad de voz."""
+        raise NotImplementedError
+
+    def reset_states(self):
+        self.input.fill(0)
+        self.triggered = False
+        self.temp_end = 0
+        self.current_sample = 0
+
+    def __call__(self, chunk, return_seconds=False):
+        window_size_samples = len(chunk)
+        # contexto (64) + chunk (512) en un único buffer reutilizado
+        self.input[0, :VAD_CONTEXT_SIZE] = self.input[0, -VAD_CONTEXT_SIZE:]
+        self.input[0, VAD_CONTEXT_SIZE:] = chunk
+        speech_prob = self._infer()
+        self.current_sample += window_size_samples
+
+        if speech_prob >= self.threshold and self.temp_end:
+            self.temp_end = 0
+
+        if speech_prob >= self.threshold and not self.triggered:
+            self.triggered = True
+            speech_start = max(0, self.current_sample - self.speech_pad_samples - window_size_samples)
+            return {"start": round(speech_start / self.sampling_rate, 1) if return_seconds else int(speech_start)}
+
+        if speech_prob < self.threshold - 0.15 and self.triggered:
+            if not self.temp_end:
+                self.temp_end = self.current_sample
+            if self.current_sample - self.temp_end < self.min_silence_samples:
+                return None
+            speech_end = self.temp_end + self.speech_pad_samples - window_size_samples
+            self.temp_end = 0
+            self.triggered = False
+            return {"end": round(speech_end / self.sampling_rate, 1) if return_seconds else int(speech_end)}
+
+        return None
+
+
+class OnnxVADIterator(VADIterator):
+    """
+    VADIterator sobre una sesión ONNX Runtime.
+
+    Las entradas/salidas se enlazan una sola vez con io_binding sobre arrays
+    preallocados: el estado alterna entre dos buffers (state -> stateN y al
+    revés), así cada chunk solo paga session.run sin reconstruir el feed dict.
+    """
+
+    def __init__(self, session, **kwargs):
+        self.session = session
+        self.sr = np.array(kwargs.get("sampling_rate", VAD_SAMPLE_RATE), dtype=np.int64)
+        self.states = (np.zeros((2, 1, 128), dtype=np.float32), np.zeros((2, 1, 128), dtype=np.float32))
+        self.output = np.zeros((1, 1), dtype=np.float32)
+        super().__init__(**kwargs)
+        self.bindings = (
+            self._bind(self.states[0], self.states[1]),
+            self._bind(self.states[1], self.states[0]),
+        )
+
+    def _bind(self, state_in, state_out):
+        binding = self.session.io_binding()
+        binding.bind_cpu_input("input", self.input)
+        binding.bind_cpu_input("state", state_in)
+        binding.bind_cpu_input("sr", self.sr)
+        binding.bind_output("output", "cpu", 0, np.float32, self.output.shape, self.output.ctypes.data)
+        binding.bind_output("stateN", "cpu", 0, np.float32, state_out.shape, state_out.ctypes.data)
+        return binding
+
+    def reset_states(self):
+        for state in self.states:
+            state.fill(0)
+        self.step = 0
+        super().reset_states()
+
+    def _infer(self):
+        self.session.run_with_iobinding(self.bindings[self.step & 1])
+        self.step += 1
+        return float(self.output[0, 0])
+
+
+class OpenVINOVADIterator(VADIterator):
+    """
+    VADIterator sobre un modelo compilado de OpenVINO (un InferRequest por
+    conexión). El estado es un array numpy persistente reutilizado entre llamadas.
+    """
+
+    def __init__(self, compiled_model, **kwargs):
+        self.request = compiled_model.create_infer_request()
+        self.state = np.zeros((2, 1, 128), dtype=np.float32)
+        super().__init__(**kwargs)
+
+    def reset_states(self):
+        self.state.fill(0)
+        super().reset_states()
+
+    def _infer(self):
+        self.request.infer({"input": self.input, "state": self.state}, share_inputs=True)
+        self.state[...] = self.request.get_tensor("stateN").data
+        return float(self.request.get_tensor("output").data[0, 0])
+
+
 # --- Carga del Modelo VAD ---
 try:
-    model, utils = torch.hub.load(
-        repo_or_dir='snakers4/silero-vad',
-        model='silero_vad',
-        force_reload=False,
-        onnx=False
-    )
-    (get_speech_timestamps, save_audio, read_audio, VADIterator, collect_chunks) = utils
-    print("Modelo Silero VAD cargado exitosamente.")
+    if VAD_BACKEND == "openvino":
+        import openvino as ov
+        core = ov.Core()
+        vad_model = core.compile_model(
+            VAD_OPENVINO_PATH,
+            "CPU",
+            config={"PERFORMANCE_HINT": "LATENCY", "INFERENCE_NUM_THREADS": "1"}
+        )
+        model_inputs = {i.any_name for i in vad_model.inputs}
+        expected_inputs = VAD_OPENVINO_INPUTS
+        loaded_path = VAD_OPENVINO_PATH
+    else:
+        sess_options = ort.SessionOptions()
+        sess_options.intra_op_num_threads = 1
+        sess_options.inter_op_num_threads = 1
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        vad_model = ort.InferenceSession(VAD_MODEL_PATH, sess_options=sess_options, providers=["CPUExecutionProvider"])
+        model_inputs = {i.name for i in vad_model.get_inputs()}
+        expected_inputs = VAD_MODEL_INPUTS
+        loaded_path = VAD_MODEL_PATH
+    if model_inputs != expected_inputs:
+        raise RuntimeError(f"Entradas del modelo {sorted(model_inputs)} no coinciden con {sorted(expected_inputs)}")
+    print(f"Modelo Silero VAD ({VAD_BACKEND}) cargado exitosamente desde {loaded_path}.")
 except Exception as e:
     print(f"Error al cargar el modelo Silero VAD: {e}")
-    print("Asegúrate de tener PyTorch instalado (`pip install torch`)")
-    model = None
-    VADIterator = None
+    print("Asegúrate de tener onnxruntime (u openvino) instalado y el modelo en models/")
+    vad_model = None
+
+
+def create_vad_iterator():
+    """Crea el VADIterator del backend configurado para una nueva conexión."""
+    iterator_cls = OpenVINOVADIterator if VAD_BACKEND == "openvino" else OnnxVADIterator
+    return iterator_cls(vad_model, threshold=VAD_THRESHOLD, sampling_rate=VAD_SAMPLE_RATE)
+
+
+# Pool de recursos por conexión (VADIterator con su estado/io_binding y el ring
+# buffer): al desconectar se ponen a cero y se devuelven, así abrir una
+# conexión nueva no reserva memoria.
+vad_pool: "queue.SimpleQueue[tuple]" = queue.SimpleQueue()
+
+
+def acquire_vad_resources():
+    try:
+        return vad_pool.get_nowait()
+    except queue.Empty:
+        return create_vad_iterator(), AudioRingBuffer()
+
+
+def release_vad_resources(vad_iterator, audio_buffer):
+    vad_iterator.reset_states()
+    audio_buffer.reset()
+    vad_pool.put((vad_iterator, audio_buffer))
 
 # --- Configuración de CORS ---
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
-    allow_credentials=True,
+    allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
 )
@@ -55,64 +361,65 @@ def read_root():
 @app.websocket("/ws/vad")
 async def websocket_vad_endpoint(websocket: WebSocket):
     await websocket.accept()
-    print("Cliente WebSocket conectado para VAD.")
-    
-    if model is None or VADIterator is None:
+    logger.info("Cliente WebSocket conectado para VAD.")
+
+    if vad_model is None:
         await websocket.send_json({"error": "Modelo VAD no está cargado en el servidor."})
         await websocket.close()
         return
 
-    vad_iterator = VADIterator(model, threshold=0.5, sampling_rate=VAD_SAMPLE_RATE)
-    audio_buffer = torch.tensor([])
+    vad_iterator, audio_buffer = acquire_vad_resources()
+    write_audio = audio_buffer.write_pcm16 if VAD_INPUT_FORMAT == "int16" else audio_buffer.write_bytes
 
     try:
         while True:
             data = await websocket.receive_bytes()
-            
-            try:
-                # --- CORRECCIÓN 2 (Warning) ---
-                # Añadimos .copy() para crear un array de numpy escribible.
-                # Esto soluciona la 'UserWarning' que vimos en el log.
-                writable_audio_chunk = np.frombuffer(data, dtype=np.float32).copy()
-                new_audio_chunk = torch.from_numpy(writable_audio_chunk)
-                # --- FIN DE LA CORRECCIÓN 2 ---
 
+            try:
+                write_audio(data)
             except Exception as e:
-                print(f"Error al decodificar audio: {e}")
-                continue 
-
-            audio_buffer = torch.cat([audio_buffer, new_audio_chunk])
+                logger.warning("Error al decodificar audio: %s", e)
+                continue
 
             # 6. Procesar el buffer en los tamaños de chunk que espera el VAD
             # Este bucle ahora procesará el buffer en chunks de 512
-            while audio_buffer.shape[0] >= VAD_CHUNK_SIZE:
-                chunk_to_process = audio_buffer[:VAD_CHUNK_SIZE]
-                audio_buffer = audio_buffer[VAD_CHUNK_SIZE:]
-                
+            while audio_buffer.count >= VAD_CHUNK_SIZE:
+                chunk_to_process = audio_buffer.read(VAD_CHUNK_SIZE)
+
                 # 7. Ejecutar el VAD
                 # Esta llamada ahora recibirá un chunk de 512, como espera
                 speech_dict = vad_iterator(chunk_to_process, return_seconds=True)
-                
+
                 if speech_dict:
                     if "start" in speech_dict:
-                        print(f"Evento VAD: speech_start (tiempo: {speech_dict['start']:.2f}s)")
+                        logger.debug("Evento VAD: speech_start (tiempo: %.2fs)", speech_dict["start"])
                         await websocket.send_json({"event": "speech_start"})
                     elif "end" in speech_dict:
-                        print(f"Evento VAD: speech_end (tiempo: {speech_dict['end']:.2f}s)")
+                        logger.debug("Evento VAD: speech_end (tiempo: %.2fs)", speech_dict["end"])
                         await websocket.send_json({"event": "speech_end"})
 
     except WebSocketDisconnect:
-        print("Cliente WebSocket desconectado.")
+        logger.info("Cliente WebSocket desconectado.")
     except Exception as e:
-        print(f"Error en la conexión WebSocket VAD: {e}")
+        logger.error("Error en la conexión WebSocket VAD: %s", e)
     finally:
-        if 'vad_iterator' in locals() and vad_iterator:
-            vad_iterator.reset_states()
-        print("Limpiando conexión VAD.")
+        release_vad_resources(vad_iterator, audio_buffer)
+        logger.info("Limpiando conexión VAD.")
 
 if __name__ == "__main__":
     print(f"--- Iniciando Servidor de API VAD en puerto {VAD_PORT} ---")
     print(f"Endpoint WebSocket disponible en: ws://127.0.0.1:{VAD_PORT}/ws/vad")
-    uvicorn.run(app, host="127.0.0.1", port=VAD_PORT)
+    # uvloop + httptools: menos overhead por mensaje WS (uno cada ~32ms).
+    # uvloop no existe en Windows; allí se usa el loop asyncio estándar.
+    uvicorn.run(
+        app,
+        host="127.0.0.1",
+        port=VAD_PORT,
+        loop="asyncio" if sys.platform == "win32" else "uvloop",
+        http="httptools",
+        ws="websockets",
+        ws_max_size=2**20,
+        ws_ping_interval=20
+    )
 
-#uvicorn api_vad:app --host 127.0.0.1 --port 8001
\ No newline at end of file
+#uvicorn api_vad:app --host 127.0.0.1 --port 8001 --loop uvloop --http httptools --ws websockets --ws-max-size 1048576 --ws-ping-interval 20
\ No newline at end of file
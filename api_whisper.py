@@ -15,10 +15,9 @@ POST /translate
 
 POST /translate_stream
     - Descripción: Transcribe/Traduce audio y emite segmentos por SSE (server-sent events).
-    - Respuesta: text/event-stream. Primer evento contiene job_id y metadatos.
-
-POST /stop/{job_id}
-    - Descripción: Solicita la parada de una transcripción en curso.
+    - Respuesta: text/event-stream. Primer evento contiene los metadatos; después
+      un evento "segment" por segmento devuelto por whisper.cpp y, al final, "end".
+      Mismo formato que /translate_stream de api_whisper2.py.
 '''
 
 '''
@@ -39,86 +38,77 @@ curl 127.0.0.1:8080/inference \
 import uvicorn
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
 import os
-import tempfile
-from typing import Literal, Dict, Any, Optional
-from fastapi.middleware.cors import CORSMiddleware
-import requests
-import uuid
-import threading
-import asyncio
-from fastapi.responses import StreamingResponse, JSONResponse
-import json
-import time
-
-# ------------------
-# Cache local de modelos
-# ------------------
-SAVE_AUDIOS = True  # Mantienes tu configuración
-
-BASE_DIR = os.path.dirname(__file__)
-MODELS_DIR = os.path.join(BASE_DIR, "models")
-AUDIOS_DIR = os.path.join(BASE_DIR, "audios")
-
-os.makedirs(MODELS_DIR, exist_ok=True)
-os.makedirs(AUDIOS_DIR, exist_ok=True)
-
-os.environ.setdefault("HF_HOME", MODELS_DIR)
-os.environ.setdefault("TRANSFORMERS_CACHE", MODELS_DIR)
-os.environ.setdefault("XDG_CACHE_HOME", MODELS_DIR)
-
-print(f"Model cache dir: {MODELS_DIR}")
-# ------------------
-
-# --- Configuración (Modifica esto según tu PC) ---
-COMPUTE_DEVICE = "cuda"  # Opciones: "cpu", "cuda", "mps"
-COMPUTE_TYPE = "float32"  # Opciones: "int8", "int16", "float16", "float32"
-# ----------------------------------------------------
-
-availableModels = ["tiny", "base", "small", "medium", "large-v2", "large-v3"]
-availableLanguajes = ["auto", "en", "es", "fr", "de", "it", "pt", "ru", "zh", "ja", "ko"]
-
-ModelSize = Literal["tiny", "base", "small", "medium", "large-v2", "large-v3"]
+from typing import Dict, Any, Optional
+import httpx
+from fastapi.responses import StreamingResponse
+import orjson
+
+# Configuración, uploads y CORS compartidos con api_whisper2.py
+from whisper_core import (
+    SAVE_AUDIOS, availableModels, availableLanguajes, ModelSize,
+    add_cors, sse_format, save_upload, remove_upload,
+)
 
 app = FastAPI()
+add_cors(app)
 
-# --- Configuración de CORS ---
-origins = ["*"]
+WHISPER_CPP_URL = "http://127.0.0.1:8080/inference"
+
+# Cliente HTTP asíncrono compartido: no bloquea el event loop mientras
+# whisper.cpp procesa, así varias peticiones pueden estar en curso a la vez.
+whisper_cpp_client = httpx.AsyncClient(timeout=300.0)
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-# -----------------------------
 
-def call_whisper_cpp_api(
+@app.on_event("shutdown")
+async def close_whisper_cpp_client():
+    await whisper_cpp_client.aclose()
+
+
+async def request_whisper_cpp(
+    audio_path: str,
+    response_format: str = "json",
+    temperature: float = 0.0,
+    temperature_inc: float = 0.2,
+    language: str = "auto"
+) -> Dict[str, Any]:
+    """
+    Envía el archivo de audio a whisper.cpp y devuelve el JSON de respuesta.
+    """
+    with open(audio_path, "rb") as audio_file:
+        audio_bytes = audio_file.read()
+    files = {"file": (os.path.basename(audio_path), audio_bytes, "audio/wav")}
+    data = {
+        "temperature": temperature,
+        "temperature_inc": temperature_inc,
+        "response_format": response_format,
+        "language": language
+    }
+    response = await whisper_cpp_client.post(WHISPER_CPP_URL, files=files, data=data)
+    if response.status_code != 200:
+        raise HTTPException(status_code=response.status_code, detail=response.text)
+    return response.json()
+
+
+async def call_whisper_cpp_api(
     audio_path: str, 
     temperature: float = 0.0, 
     temperature_inc: float = 0.2,
     language: str = "auto"
-) -> Dict[str, Any]:
+) -> str:
     """
     Llama a la API de whisper.cpp para procesar el archivo de audio.
     """
-    url = "http://127.0.0.1:8080/inference"
-    with open(audio_path, "rb") as audio_file:
-        files = {"file": audio_file}
-        data = {
-            "temperature": temperature,
-            "temperature_inc": temperature_inc,
-            "response_format": "json",
-            "language": language
-        }
-        response = requests.post(url, files=files, data=data)
-        if response.status_code != 200:
-            raise HTTPException(status_code=response.status_code, detail=response.text)
+    result = await request_whisper_cpp(
+        audio_path,
+        temperature=temperature,
+        temperature_inc=temperature_inc,
+        language=language
+    )
+    text = result.get("text", "")
+    print(f"[whisper.cpp] Respuesta recibida: {result}")
+    print(f"[whisper.cpp] Respuesta recibida: {text}")
+    return text
 
-        text = response.json().get("text", "")
-        print(f"[whisper.cpp] Respuesta recibida: {response.json()}")   
-        print(f"[whisper.cpp] Respuesta recibida: {text}")   
-        return text
 
 @app.get("/models")
 async def getModels():
@@ -143,34 +133,10 @@ async def translate_audio(
     tmp_file_path: Optional[str] = None
     try:
         # Guardar el archivo de audio
-        if SAVE_AUDIOS:
-            os.makedirs(AUDIOS_DIR, exist_ok=True)
-            name = "audio" + str(int(time.time() * 1000))
-            name += "_" + (audio_file.filename or "upload.wav")
-            safe_name = os.path.basename(name)
-            dst_path = os.path.join(AUDIOS_DIR, safe_name)
-            try:
-                print(f"[audio] Guardando audio en: {dst_path}")
-                content = await audio_file.read()
-                with open(dst_path, "wb") as f:
-                    f.write(content)
-                tmp_file_path = dst_path
-                try:
-                    size = os.path.getsize(dst_path)
-                    print(f"[audio] Guardado {size} bytes en {dst_path}")
-                except Exception:
-                    print(f"[audio] Guardado en {dst_path} (tamaño desconocido)")
-            except Exception as e:
-                print(f"[audio][error] No se pudo guardar el audio en {dst_path}: {e}")
-                raise HTTPException(status_code=500, detail=f"Error al guardar audio: {e}")
-        else:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=audio_file.filename or ".wav") as tmp_file:
-                content = await audio_file.read()
-                tmp_file.write(content)
-                tmp_file_path = tmp_file.name
+        tmp_file_path = await save_upload(audio_file)
 
         # Llamar a whisper.cpp API
-        result = call_whisper_cpp_api(tmp_file_path, language=language)
+        result = await call_whisper_cpp_api(tmp_file_path, language=language)
         
         return {
             "model_used": model_size,
@@ -186,19 +152,61 @@ async def translate_audio(
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         # Limpieza de archivo temporal si corresponde
-        if not SAVE_AUDIOS and tmp_file_path and os.path.exists(tmp_file_path):
-            try:
-                print(f"Limpiando archivo temporal: {tmp_file_path}")
-                os.unlink(tmp_file_path)
-            except Exception:
-                pass
-        elif SAVE_AUDIOS and tmp_file_path:
+        if SAVE_AUDIOS and tmp_file_path:
             print(f"Audio conservado en: {tmp_file_path}")
+        else:
+            remove_upload(tmp_file_path)
+
+
+@app.post("/translate_stream")
+async def translate_stream(
+    model_size: ModelSize = Form("small"),
+    audio_file: UploadFile = File(...),
+    language: str = Form("es")
+):
+    """
+    Endpoint streaming vía SSE. Emite eventos JSON en formato:
+    { "type": "meta"|"segment"|"error"|"end", "payload": { ... } }
+    whisper.cpp devuelve la respuesta completa (verbose_json); cada segmento se
+    reenvía como un evento para que el cliente pueda ir pintando el texto.
+    """
+    tmp_file_path: Optional[str] = None
+    try:
+        # Guardar audio (reutiliza lógica)
+        tmp_file_path = await save_upload(audio_file)
+    except Exception as e:
+        remove_upload(tmp_file_path)
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def event_generator():
+        try:
+            result = await request_whisper_cpp(tmp_file_path, response_format="verbose_json", language=language)
+            meta = {
+                "model_used": model_size,
+                "detected_language": result.get("language"),
+                "language_requested": language
+            }
+            yield sse_format(orjson.dumps({"type": "meta", "payload": meta}))
+            for segment in result.get("segments", []):
+                payload = {
+                    "text": segment.get("text", ""),
+                    "start": segment.get("start"),
+                    "end": segment.get("end")
+                }
+                yield sse_format(orjson.dumps({"type": "segment", "payload": payload}))
+        except Exception as e:
+            detail = e.detail if isinstance(e, HTTPException) else str(e)
+            yield sse_format(orjson.dumps({"type": "error", "payload": {"detail": detail}}))
+        finally:
+            # cleanup
+            remove_upload(tmp_file_path)
+        yield sse_format(orjson.dumps({"type": "end"}))
+
+    return StreamingResponse(event_generator(), media_type="text/event-stream")
 
 if __name__ == "__main__":
     print(f"--- Iniciando Servidor de API Whisper ---")
-    print(f"Dispositivo: {COMPUTE_DEVICE} (Tipo: {COMPUTE_TYPE})")
     print(f"Modelos disponibles: tiny, base, small, medium, large-v2, large-v3")
     print(f"Endpoint disponible en: http://127.0.0.1:8000/translate_stream (SSE)")
-    print("Inicia con: uvicorn api_whisper:app --host 127.0.0.1 --port 8000")
-    # uvicorn.run(app, host="127.0.0.1", port=8000")
+    print("Inicia con: uvicorn api_whisper:app --host 127.0.0.1 --port 8000 --loop uvloop --http httptools")
+    # uvicorn.run(app, host="127.0.0.1", port=8000, loop="uvloop", http="httptools")
@@ -13,6 +13,8 @@ GET /languages
 POST /translate
     - Descripción: Transcribe o traduce un archivo de audio (respuesta tradicional).
     - Tipo: multipart/form-data
+    - Con stream=true responde application/x-ndjson: una línea JSON por evento
+      (meta, segment, error, end) a medida que el decoder produce segmentos.
 
 POST /translate_stream
     - Descripción: Transcribe/Traduce audio y emite segmentos por SSE (server-sent events).
@@ -33,96 +35,150 @@ GGML_VULKAN=1 pip install git+https://github.com/absadiki/pywhispercpp
 
 import uvicorn
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException
-from faster_whisper import WhisperModel
 import os
-import tempfile
-from typing import Literal, Dict, Any, Optional
-from fastapi.middleware.cors import CORSMiddleware
+from typing import Dict, Any, Callable, Optional, Mapping
 
 # Nuevos imports para streaming / control
 import uuid
-import threading
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 import asyncio
 from fastapi.responses import StreamingResponse, JSONResponse
-import json
-import time
+# orjson (incluido en fastapi[all]): serializa los eventos SSE/NDJSON más rápido y devuelve bytes
+import orjson
+
+# Configuración, caché de modelos, uploads y transcripción compartidos con api_whisper.py
+from whisper_core import (
+    SAVE_AUDIOS, COMPUTE_DEVICE, COMPUTE_TYPE, DEFAULT_MODEL, DEFAULT_BEAM_SIZE, MAX_BEAM_SIZE,
+    CACHE_WAVEFORMS, WHISPER_PRELOAD, availableModels, availableLanguajes, ModelSize, WhisperModel,
+    add_cors, sse_format, save_upload, remove_upload, new_audio_hash,
+    get_model_async, get_model_lock, warmup_model,
+    load_audio, transcribe_kwargs_for, transcribe_sync,
+)
 
-# ------------------
-# Cache local de modelos
-# ------------------
-SAVE_AUDIOS = True  # Mantienes tu configuración
+app = FastAPI()
+add_cors(app)
 
-BASE_DIR = os.path.dirname(__file__)
-MODELS_DIR = os.path.join(BASE_DIR, "models")
-AUDIOS_DIR = os.path.join(BASE_DIR, "audios")
 
-os.makedirs(MODELS_DIR, exist_ok=True)
-os.makedirs(AUDIOS_DIR, exist_ok=True)
+# Hilos reutilizables para los endpoints en streaming (sin crear un Thread por petición)
+EXECUTOR = ThreadPoolExecutor(max_workers=max(2, (os.cpu_count() or 2) // 2), thread_name_prefix="whisper")
 
-os.environ.setdefault("HF_HOME", MODELS_DIR)
-os.environ.setdefault("TRANSFORMERS_CACHE", MODELS_DIR)
-os.environ.setdefault("XDG_CACHE_HOME", MODELS_DIR)
 
-print(f"Model cache dir: {MODELS_DIR}")
-# ------------------
+def queue_put(loop: asyncio.AbstractEventLoop, q: asyncio.Queue, item):
+    """Encola desde el hilo worker en el event loop; si el loop ya se cerró (apagado) se descarta."""
+    try:
+        loop.call_soon_threadsafe(q.put_nowait, item)
+    except RuntimeError:
+        pass
 
-# --- Configuración (Modifica esto según tu PC) ---
-COMPUTE_DEVICE = "cpu"  # Opciones: "cpu", "cuda", "mps"
-COMPUTE_TYPE = "int16"  # Opciones: "int8", "int16", "float16", "float32"
-# ----------------------------------------------------
 
-availableModels = ["tiny", "base", "small", "medium", "large-v2", "large-v3"]
-availableLanguajes = ["auto", "en", "es", "fr", "de", "it", "pt", "ru", "zh", "ja", "ko"]
+@app.on_event("startup")
+async def _warmup():
+    """
+    Precarga los modelos de WHISPER_PRELOAD al arrancar para que la primera
+    petición no pague la carga (que bloquea el event loop varios segundos).
+    Un fallo no impide arrancar: ese modelo se carga en su primera petición.
+    """
+    for size in WHISPER_PRELOAD.split(","):
+        size = size.strip()
+        if not size:
+            continue
+        if size not in availableModels:
+            print(f"[warmup] Modelo desconocido en WHISPER_PRELOAD: '{size}'")
+            continue
+        try:
+            await asyncio.to_thread(warmup_model, size)
+        except Exception as e:
+            print(f"[warmup] No se pudo precargar '{size}' (se cargará en la primera petición): {getattr(e, 'detail', e)}")
 
-ModelSize = Literal["tiny", "base", "small", "medium", "large-v2", "large-v3"]
 
-app = FastAPI()
+@app.on_event("shutdown")
+async def _shutdown_executor():
+    EXECUTOR.shutdown(wait=False, cancel_futures=True)
 
-# --- Configuración de CORS ---
-origins = ["*"]
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=origins,
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
-# -----------------------------
+# -------------------------------
+# Job registry global para control de parada
+# job_registry: job_id -> asyncio.Event(). El generador borra su entrada al
+# terminar; las referencias débiles solo cubren jobs que nunca llegan a ejecutarse.
+# -------------------------------
+job_registry: "weakref.WeakValueDictionary[str, asyncio.Event]" = weakref.WeakValueDictionary()
+# El worker comprueba la parada cada CANCEL_CHECK_EVERY segmentos
+CANCEL_CHECK_EVERY = 4
 
-model_cache: Dict[str, WhisperModel] = {}
 
 
-def get_model(model_size: str) -> WhisperModel:
+async def stream_transcription(model: "WhisperModel", model_size: str, audio_path: str,
+                               transcribe_kwargs: Mapping[str, Any],
+                               fmt: Callable[[Dict[str, Any]], bytes],
+                               audio_key: Optional[str] = None, job_id: Optional[str] = None):
     """
-    Carga un modelo en el caché si no existe y lo retorna.
+    Productor común de /translate?stream (NDJSON) y /translate_stream (SSE): un
+    hilo del EXECUTOR itera los segmentos del decoder y los pasa por una cola al
+    event loop, que los emite uno a uno (TTFB = primer segmento). fmt serializa
+    cada evento al formato del endpoint. Con job_id la parada se registra para /stop.
+    El generador es dueño del archivo: lo borra al terminar.
     """
-    if model_size not in model_cache:
-        print(f"Cargando modelo '{model_size}' en {COMPUTE_DEVICE}...")
+    loop = asyncio.get_running_loop()
+    q: asyncio.Queue = asyncio.Queue()
+    cancel_flag = asyncio.Event()
+    if job_id is not None:
+        job_registry[job_id] = cancel_flag
+
+    def transcribe_worker():
         try:
-            model = WhisperModel(model_size, device=COMPUTE_DEVICE, compute_type=COMPUTE_TYPE)
-            model_cache[model_size] = model
-            print(f"Modelo '{model_size}' cargado y listo.")
+            segments, info = model.transcribe(load_audio(audio_path, audio_key), **transcribe_kwargs)
+            meta = {
+                "model_used": model_size,
+                "detected_language": getattr(info, "language", None),
+                "task_used": transcribe_kwargs.get("task")
+            }
+            if job_id is not None:
+                meta = {"job_id": job_id, **meta}
+            queue_put(loop, q, fmt({"type": "meta", "payload": meta}))
+
+            for i, segment in enumerate(segments):
+                # Solo se lee el flag (lo ponen /stop o el event loop), válido desde el hilo
+                if i % CANCEL_CHECK_EVERY == 0 and cancel_flag.is_set():
+                    queue_put(loop, q, fmt({"type": "stopped", "payload": {"reason": "cancelled"}}))
+                    break
+                queue_put(loop, q, fmt({"type": "segment", "payload": {
+                    "text": segment.text,
+                    "start": getattr(segment, "start", None),
+                    "end": getattr(segment, "end", None)
+                }}))
         except Exception as e:
-            raise HTTPException(
-                status_code=500,
-                detail=f"Error al cargar el modelo {model_size}: {e}"
-            )
-    return model_cache[model_size]
+            queue_put(loop, q, fmt({"type": "error", "payload": {"detail": str(e)}}))
+        finally:
+            # señal de fin
+            queue_put(loop, q, None)
 
+    model_lock = get_model_lock(model_size)
+    try:
+        await model_lock.acquire()
+        # El semáforo se libera en el event loop cuando el worker termina
+        loop.run_in_executor(EXECUTOR, transcribe_worker).add_done_callback(lambda _: model_lock.release())
+        while True:
+            item = await q.get()
+            if item is None:
+                yield fmt({"type": "end"})
+                break
+            yield item
+    finally:
+        # Fin, error o cliente desconectado (GeneratorExit/CancelledError):
+        # el hilo deja de iterar segmentos y suelta el modelo cuanto antes
+        cancel_flag.set()
+        if job_id is not None:
+            job_registry.pop(job_id, None)
+        remove_upload(audio_path)
 
-# -------------------------------
-# Job registry global para control de parada
-# job_registry: job_id -> threading.Event()
-# -------------------------------
-job_registry: Dict[str, threading.Event] = {}
-# opcional para debug/info: guardar metadatos
-job_meta: Dict[str, Dict[str, Any]] = {}
 
+def ndjson_event(event: Dict[str, Any]) -> bytes:
+    return orjson.dumps(event) + b"\n"
 
-def sse_format(data: str) -> str:
-    """Formatea un string para SSE"""
-    return f"data: {data}\n\n"
+
+def sse_event(event: Dict[str, Any]) -> bytes:
+    return sse_format(orjson.dumps(event))
 
 
 @app.get("/models")
@@ -140,67 +196,45 @@ async def getLanguajes():
 
 @app.post("/translate")
 async def translate_audio(
-    model_size: ModelSize = Form("small"),
+    model_size: ModelSize = Form(DEFAULT_MODEL),
     audio_file: UploadFile = File(...),
     # El cliente envía "" (vacío) para auto, no "auto". El default "auto"
     # solo se usaría si el cliente NO envía el parámetro.
-    language: str = Form("es")
+    language: str = Form("es"),
+    beam_size: int = Form(DEFAULT_BEAM_SIZE, ge=1, le=MAX_BEAM_SIZE),
+    stream: bool = Form(False)
 ):
     """
     Endpoint de API para traducir audio (respuesta tradicional).
+    Con stream=true emite los segmentos como NDJSON según se decodifican.
     """
     tmp_file_path: Optional[str] = None
     try:
         # 1. Cargar el modelo
-        model = get_model(model_size)
+        model = await get_model_async(model_size)
 
         # 2. Guardar el archivo de audio
-        if SAVE_AUDIOS:
-            os.makedirs(AUDIOS_DIR, exist_ok=True)
-            name = "audio" + str(int(time.time() * 1000))
-            name += "_" + (audio_file.filename or "upload.wav")
-            safe_name = os.path.basename(name)
-            dst_path = os.path.join(AUDIOS_DIR, safe_name)
-            try:
-                print(f"[audio] Guardando audio en: {dst_path}")
-                content = await audio_file.read()
-                with open(dst_path, "wb") as f:
-                    f.write(content)
-                tmp_file_path = dst_path
-                try:
-                    size = os.path.getsize(dst_path)
-                    print(f"[audio] Guardado {size} bytes en {dst_path}")
-                except Exception:
-                    print(f"[audio] Guardado en {dst_path} (tamaño desconocido)")
-            except Exception as e:
-                print(f"[audio][error] No se pudo guardar el audio en {dst_path}: {e}")
-                raise HTTPException(status_code=500, detail=f"Error al guardar audio: {e}")
-        else:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=audio_file.filename or ".wav") as tmp_file:
-                content = await audio_file.read()
-                tmp_file.write(content)
-                tmp_file_path = tmp_file.name
+        # Solo se hashea el contenido si hay caché de waveforms que lo use
+        audio_hash = new_audio_hash() if CACHE_WAVEFORMS else None
+        tmp_file_path = await save_upload(audio_file, audio_hash)
+        audio_key = audio_hash.hexdigest() if audio_hash is not None else None
 
         # 3. Ejecutar la transcripción/traducción.
-        is_auto_detect = (language == "auto" or language == "")
-        language_param = None if is_auto_detect else language
-        if is_auto_detect or language == "en":
-            task = "translate"
-        else:
-            task = "transcribe"
-
-        transcribe_kwargs = {'task': task}
-        if language_param:
-            transcribe_kwargs['language'] = language_param
-
-        segments, info = get_model(model_size).transcribe(
-            tmp_file_path,
-            **transcribe_kwargs
-        )
+        transcribe_kwargs = transcribe_kwargs_for(language, beam_size)
+        task = transcribe_kwargs['task']
+
+        if stream:
+            # El generador pasa a ser dueño del archivo (lo borra al terminar)
+            audio_path, tmp_file_path = tmp_file_path, None
+            return StreamingResponse(
+                stream_transcription(model, model_size, audio_path, transcribe_kwargs, ndjson_event, audio_key=audio_key),
+                media_type="application/x-ndjson"
+            )
 
-        print(f"Idioma detectado: {info.language} (Probabilidad: {getattr(info, 'language_probability', 0):.2f}) | task={task} | forced_language={language_param}")
+        async with get_model_lock(model_size):
+            full_text, info = await asyncio.to_thread(transcribe_sync, model, tmp_file_path, language, beam_size, audio_key)
 
-        full_text = "".join(segment.text for segment in segments)
+        print(f"Idioma detectado: {info.language} (Probabilidad: {getattr(info, 'language_probability', 0):.2f}) | task={task} | forced_language={transcribe_kwargs.get('language')}")
 
         return {
             "model_used": model_size,
@@ -215,21 +249,18 @@ async def translate_audio(
         raise HTTPException(status_code=500, detail=str(e))
     finally:
         # Limpieza de archivo temporal si corresponde
-        if not SAVE_AUDIOS and tmp_file_path and os.path.exists(tmp_file_path):
-            try:
-                print(f"Limpiando archivo temporal: {tmp_file_path}")
-                os.unlink(tmp_file_path)
-            except Exception:
-                pass
-        elif SAVE_AUDIOS and tmp_file_path:
+        if SAVE_AUDIOS and tmp_file_path:
             print(f"Audio conservado en: {tmp_file_path}")
+        else:
+            remove_upload(tmp_file_path)
 
 
 @app.post("/translate_stream")
 async def translate_stream(
-    model_size: ModelSize = Form("small"),
+    model_size: ModelSize = Form(DEFAULT_MODEL),
     audio_file: UploadFile = File(...),
-    language: str = Form("es")
+    language: str = Form("es"),
+    beam_size: int = Form(DEFAULT_BEAM_SIZE, ge=1, le=MAX_BEAM_SIZE)
 ):
     """
     Endpoint streaming vía SSE. Emite eventos JSON en formato:
@@ -239,106 +270,27 @@ async def translate_stream(
     tmp_file_path: Optional[str] = None
     try:
         # Guardar audio (reutiliza lógica)
-        if SAVE_AUDIOS:
-            os.makedirs(AUDIOS_DIR, exist_ok=True)
-            name = "audio" + str(int(time.time() * 1000))
-            name += "_" + (audio_file.filename or "upload.wav")
-            safe_name = os.path.basename(name)
-            dst_path = os.path.join(AUDIOS_DIR, safe_name)
-            content = await audio_file.read()
-            with open(dst_path, "wb") as f:
-                f.write(content)
-            tmp_file_path = dst_path
-        else:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=audio_file.filename or ".wav") as tmp_file:
-                content = await audio_file.read()
-                tmp_file.write(content)
-                tmp_file_path = tmp_file.name
+        # Solo se hashea el contenido si hay caché de waveforms que lo use
+        audio_hash = new_audio_hash() if CACHE_WAVEFORMS else None
+        tmp_file_path = await save_upload(audio_file, audio_hash)
+        audio_key = audio_hash.hexdigest() if audio_hash is not None else None
 
         # Preparar job
-        model = get_model(model_size)
+        model = await get_model_async(model_size)
         job_id = str(uuid.uuid4())
-        q: asyncio.Queue = asyncio.Queue()
-        cancel_flag = threading.Event()
-        job_registry[job_id] = cancel_flag
-        job_meta[job_id] = {"model_used": model_size, "created_at": time.time()}
-
-        loop = asyncio.get_running_loop()
-
-        def transcribe_worker():
-            try:
-                is_auto_detect = (language == "auto" or language == "")
-                language_param = None if is_auto_detect else language
-                task = "translate" if (is_auto_detect or language == "en") else "transcribe"
-                transcribe_kwargs = {'task': task}
-                if language_param:
-                    transcribe_kwargs['language'] = language_param
-
-                # Ejecuta transcripción. segments puede ser iterable/generador
-                segments, info = model.transcribe(tmp_file_path, **transcribe_kwargs)
-
-                # enviar meta
-                meta = {
-                    "job_id": job_id,
-                    "model_used": model_size,
-                    "detected_language": getattr(info, "language", None),
-                    "task_used": task
-                }
-                loop.call_soon_threadsafe(q.put_nowait, json.dumps({"type": "meta", "payload": meta}))
-
-                for segment in segments:
-                    if cancel_flag.is_set():
-                        loop.call_soon_threadsafe(q.put_nowait, json.dumps({"type": "stopped", "payload": {"reason": "cancelled"}}))
-                        break
-                    payload = {
-                        "text": segment.text,
-                        "start": getattr(segment, "start", None),
-                        "end": getattr(segment, "end", None)
-                    }
-                    loop.call_soon_threadsafe(q.put_nowait, json.dumps({"type": "segment", "payload": payload}))
-
-            except Exception as e:
-                loop.call_soon_threadsafe(q.put_nowait, json.dumps({"type": "error", "payload": {"detail": str(e)}}))
-            finally:
-                # señal de fin
-                loop.call_soon_threadsafe(q.put_nowait, None)
-
-        thread = threading.Thread(target=transcribe_worker, daemon=True)
-        thread.start()
-
-        async def event_generator():
-            try:
-                while True:
-                    item = await q.get()
-                    if item is None:
-                        yield sse_format(json.dumps({"type": "end"}))
-                        break
-                    yield sse_format(item)
-            except asyncio.CancelledError:
-                # cliente cerró la conexión; solicitar parada
-                cancel_flag.set()
-                raise
-            finally:
-                # cleanup
-                job_registry.pop(job_id, None)
-                job_meta.pop(job_id, None)
-                if not SAVE_AUDIOS and tmp_file_path and os.path.exists(tmp_file_path):
-                    try:
-                        os.unlink(tmp_file_path)
-                    except Exception:
-                        pass
-
-        return StreamingResponse(event_generator(), media_type="text/event-stream")
+        transcribe_kwargs = transcribe_kwargs_for(language, beam_size)
+
+        # El generador pasa a ser dueño del archivo (lo borra al terminar)
+        audio_path, tmp_file_path = tmp_file_path, None
+        return StreamingResponse(
+            stream_transcription(model, model_size, audio_path, transcribe_kwargs, sse_event,
+                                 audio_key=audio_key, job_id=job_id),
+            media_type="text/event-stream"
+        )
 
     except Exception as e:
         # En caso de error, intentar limpieza inmediata
-        if job_registry.get(job_id):
-            job_registry.pop(job_id, None)
-        if tmp_file_path and not SAVE_AUDIOS and os.path.exists(tmp_file_path):
-            try:
-                os.unlink(tmp_file_path)
-            except Exception:
-                pass
+        remove_upload(tmp_file_path)
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -359,5 +311,6 @@ if __name__ == "__main__":
     print(f"Dispositivo: {COMPUTE_DEVICE} (Tipo: {COMPUTE_TYPE})")
     print(f"Modelos disponibles: tiny, base, small, medium, large-v2, large-v3")
     print(f"Endpoint disponible en: http://127.0.0.1:8000/translate_stream (SSE)")
-    print("Inicia con: uvicorn api_whisper:app --host 127.0.0.1 --port 8000")
-    # uvicorn.run(app, host="127.0.0.1", port=8000)
+    print("Inicia con: uvicorn api_whisper:app --host 127.0.0.1 --port 8000 --loop uvloop --http httptools")
+    print("Varios procesos: gunicorn -c gunicorn_conf.py api_whisper2:app")
+    # uvicorn.run(app, host="127.0.0.1", port=8000, loop="uvloop", http="httptools")
@@ -176,7 +176,7 @@ async function startDetection() {
     // Inicializar Recorder y empezar a recibir audio
     recorder.onAudio((float32arr) => {
       // Enviar audio bruto al VAD (VAD siempre activo)
-      vad.sendAudio(float32arr.buffer);
+      vad.sendAudio(float32arr);
     });
 
     await recorder.start();
@@ -6,7 +6,7 @@
 //   const vad = new VAD(url);
 //   vad.on('speech_start', cb);
 //   await vad.connect();
-//   vad.sendAudio(arrayBuffer); // opcional
+//   vad.sendAudio(float32Array); // opcional, se envía como PCM16
 //   vad.disconnect();
 
 
@@ -75,10 +75,22 @@ export default class VAD {
     }
   }
 
-  sendAudio(arrayBuffer) {
+  // Convierte muestras float32 [-1, 1] a PCM16: el servidor VAD espera int16
+  // (mitad de bytes por muestra que float32).
+  static toInt16(float32Array) {
+    const out = new Int16Array(float32Array.length);
+    for (let i = 0; i < float32Array.length; i++) {
+      const s = Math.max(-1, Math.min(1, float32Array[i]));
+      out[i] = s < 0 ? s * 0x8000 : s * 0x7fff;
+    }
+    return out;
+  }
+
+  sendAudio(audio) {
     if (this.socket && this.socket.readyState === WebSocket.OPEN) {
       try {
-        this.socket.send(arrayBuffer);
+        const samples = audio instanceof Float32Array ? audio : new Float32Array(audio);
+        this.socket.send(VAD.toInt16(samples).buffer);
       } catch (e) {
         this._emit('error', e);
       }
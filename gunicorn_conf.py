@@ -0,0 +1,29 @@
+"""
+Configuración de gunicorn para servir api_whisper2 con varios procesos:
+
+    gunicorn -c gunicorn_conf.py api_whisper2:app
+
+Cada worker importa la app después del fork y carga (y calienta) sus propios
+modelos de WHISPER_PRELOAD en el arranque. No activar preload_app: los hilos
+internos de CTranslate2 se crean al construir el modelo y no existen en el
+proceso hijo, así que un modelo heredado por fork se bloquea al transcribir.
+
+- Cada worker tiene su copia del modelo: la RAM crece con el número de workers.
+- Los hilos de CT2 se reparten entre procesos (WHISPER_THREADS = núcleos / workers)
+  para no sobresuscribir la CPU.
+- El registro de jobs es por proceso: /stop/{job_id} solo llega al job si cae
+  en el mismo worker que abrió el stream.
+
+Requiere: pip install gunicorn uvicorn-worker
+"""
+import os
+
+workers = int(os.environ.get("WHISPER_PROCESSES", 2))
+bind = os.environ.get("WHISPER_BIND", "127.0.0.1:8000")
+worker_class = "uvicorn_worker.UvicornWorker"
+# Sin preload: el modelo de CT2 no sobrevive a un fork (ver arriba)
+preload_app = False
+# Las transcripciones largas (y la carga del modelo en el arranque) no deben disparar el timeout
+timeout = 300
+
+os.environ.setdefault("WHISPER_THREADS", str(max(1, (os.cpu_count() or 1) // workers)))
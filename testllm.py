@@ -1,8 +1,13 @@
 import requests
+from requests.adapters import HTTPAdapter
 import json
+
+# Sesión reutilizable: mantiene la conexión abierta entre llamadas (sin handshake por petición)
+SESSION = requests.Session()
+SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=4, max_retries=0))
+
 url = "http://localhost:3002/v1/chat/completions"
 headers = {
-    "Content-Type": "application/json",
     "Authorization": "Bearer 2412"
 }
 data = {
@@ -11,7 +16,22 @@ data = {
         {"role": "system", "content": "Eres un asistente útil."},
         {"role": "user", "content": "Hola, ¿cómo estás?"}
     ],
-    "max_tokens": 200
-} 
-response = requests.post(url, headers=headers, data=json.dumps(data))
-print(response.json())
\ No newline at end of file
+    "max_tokens": 200,
+    "stream": True
+}
+# json= serializa y pone Content-Type; stream=True va imprimiendo los tokens según llegan (SSE)
+with SESSION.post(url, headers=headers, json=data, stream=True) as response:
+    if "text/event-stream" not in response.headers.get("content-type", ""):
+        print(response.json())
+    else:
+        for line in response.iter_lines():
+            if not line.startswith(b"data: "):
+                continue
+            chunk = line[len(b"data: "):]
+            if chunk == b"[DONE]":
+                break
+            choices = json.loads(chunk).get("choices") or [{}]
+            content = choices[0].get("delta", {}).get("content")
+            if content:
+                print(content, end="", flush=True)
+        print()
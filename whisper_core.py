@@ -0,0 +1,390 @@
+"""
+Código compartido por api_whisper.py (whisper.cpp) y api_whisper2.py (faster-whisper):
+configuración de rutas, CORS, guardado de uploads y el motor de faster-whisper
+(caché de modelos, decodificación de audio y transcripción).
+
+Ambas APIs importan de aquí, así hay un único model_cache por proceso aunque se
+carguen los dos módulos (p. ej. en pruebas).
+"""
+
+import os
+import tempfile
+import time
+import secrets
+import hashlib
+import struct
+import functools
+import threading
+import asyncio
+from types import MappingProxyType
+from typing import Literal, Dict, Any, Optional, Mapping, Tuple
+import numpy as np
+from fastapi import FastAPI, UploadFile, HTTPException
+from fastapi.middleware.cors import CORSMiddleware
+# faster-whisper solo hace falta para api_whisper2.py (api_whisper.py usa whisper.cpp)
+try:
+    from faster_whisper import WhisperModel
+except ImportError:
+    WhisperModel = None
+# Opcionales: decodificar wav/flac en proceso. Sin ellos faster-whisper decodifica la ruta (PyAV).
+try:
+    import soundfile as sf
+except ImportError:
+    sf = None
+try:
+    import resampy
+except ImportError:
+    resampy = None
+# Hash del contenido para la caché de waveforms; blake2b (stdlib) si no hay xxhash
+try:
+    import xxhash
+    new_audio_hash = xxhash.xxh3_64
+except ImportError:
+    def new_audio_hash():
+        return hashlib.blake2b(digest_size=8)
+
+# ------------------
+# Cache local de modelos
+# ------------------
+SAVE_AUDIOS = True  # Mantienes tu configuración
+
+BASE_DIR = os.path.dirname(__file__)
+MODELS_DIR = os.path.join(BASE_DIR, "models")
+AUDIOS_DIR = os.path.join(BASE_DIR, "audios")
+
+# Tamaño de bloque al volcar los uploads a disco (sin cargar el audio entero en memoria)
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Formatos que se decodifican en proceso con soundfile (el resto va por ruta)
+WHISPER_SAMPLE_RATE = 16000
+DIRECT_DECODE_EXTS = (".wav", ".flac")
+# Guarda el waveform ya decodificado en AUDIOS_DIR/<hash>.f32.npy: reenviar el
+# mismo audio (p. ej. con otro modelo) lo abre por mmap sin decodificar de nuevo.
+# Desactivado por defecto; solo con SAVE_AUDIOS, porque no se purga y vive junto
+# a los audios guardados (borrar AUDIOS_DIR limpia ambos)
+CACHE_WAVEFORMS = SAVE_AUDIOS and os.environ.get("WHISPER_CACHE_WAVEFORMS", "0") == "1"
+
+os.makedirs(MODELS_DIR, exist_ok=True)
+os.makedirs(AUDIOS_DIR, exist_ok=True)
+
+os.environ.setdefault("HF_HOME", MODELS_DIR)
+os.environ.setdefault("TRANSFORMERS_CACHE", MODELS_DIR)
+os.environ.setdefault("XDG_CACHE_HOME", MODELS_DIR)
+
+print(f"Model cache dir: {MODELS_DIR}")
+# ------------------
+
+# --- Configuración (Modifica esto según tu PC) ---
+COMPUTE_DEVICE = "cpu"  # Opciones: "cpu", "cuda", "mps"
+# int8 en CPU (kernels VNNI de oneDNN), int8_float16 en CUDA (GEMM INT8 con activaciones FP16).
+# GPUs CUDA con compute capability < 7.5 no tienen INT8 rápido: WHISPER_COMPUTE_TYPE=float16
+COMPUTE_TYPE = os.environ.get(
+    "WHISPER_COMPUTE_TYPE",
+    "int8_float16" if COMPUTE_DEVICE == "cuda" else "int8"
+)  # Opciones: "auto", "int8", "int8_float16", "float16", "float32"
+DEFAULT_MODEL = "small"
+# Modelos que se precargan (y calientan) al arrancar, separados por comas
+WHISPER_PRELOAD = os.environ.get("WHISPER_PRELOAD", DEFAULT_MODEL)
+# Paralelismo dentro de CTranslate2 (usar un solo worker de uvicorn):
+# NUM_WORKERS transcripciones pueden solaparse en el executor de CT2, cada una
+# con CPU_THREADS hilos. En CUDA los hilos de CPU no aplican (0 = por defecto).
+# Por defecto un worker con todos los núcleos; p. ej. WHISPER_NUM_WORKERS=2 y
+# WHISPER_THREADS=<núcleos/2> para solapar dos peticiones.
+NUM_WORKERS = int(os.environ.get("WHISPER_NUM_WORKERS", 1))
+CPU_THREADS = int(os.environ.get("WHISPER_THREADS", os.cpu_count() or 1)) if COMPUTE_DEVICE == "cpu" else 0
+DEVICE_INDEX = 0  # GPU a usar en CUDA (o lista, p. ej. [0, 1], para varias)
+# Opciones comunes de decodificación: el filtro VAD salta los silencios antes
+# del encoder, la búsqueda greedy evita el coste del beam search y no
+# condicionar con el texto previo corta los bucles de alucinación en audios largos.
+DEFAULT_BEAM_SIZE = 1
+# Límite del beam_size que aceptan los endpoints (cada valor ocupa una entrada de la caché de kwargs)
+MAX_BEAM_SIZE = 10
+TRANSCRIBE_OPTIONS: Dict[str, Any] = {
+    "vad_filter": True,
+    "vad_parameters": dict(min_silence_duration_ms=500),
+    "condition_on_previous_text": False,
+    "beam_size": DEFAULT_BEAM_SIZE,
+    "best_of": 1,
+    "temperature": 0.0,
+}
+# ----------------------------------------------------
+
+availableModels = ["tiny", "base", "small", "medium", "large-v2", "large-v3"]
+availableLanguajes = ["auto", "en", "es", "fr", "de", "it", "pt", "ru", "zh", "ja", "ko"]
+
+ModelSize = Literal["tiny", "base", "small", "medium", "large-v2", "large-v3"]
+
+
+def add_cors(app: FastAPI):
+    # --- Configuración de CORS ---
+    origins = ["*"]
+
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=origins,
+        # Sin cookies/credenciales: con origen "*" Starlette responde con cabeceras fijas
+        allow_credentials=False,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+
+
+# -------------------------------
+# Uploads
+# -------------------------------
+def sse_format(data: bytes) -> bytes:
+    """Formatea un payload JSON (bytes) para SSE"""
+    return b"data: " + data + b"\n\n"
+
+
+async def write_upload(audio_file: UploadFile, f, audio_hash=None) -> int:
+    """Vuelca el upload a `f` en bloques de UPLOAD_CHUNK_SIZE y devuelve los bytes escritos.
+    UploadFile.read() es async: si el spool ya está en disco la lectura va a un hilo.
+    Si se pasa audio_hash, se actualiza con cada bloque (sin releer el archivo)."""
+    total = 0
+    while chunk := await audio_file.read(UPLOAD_CHUNK_SIZE):
+        f.write(chunk)
+        if audio_hash is not None:
+            audio_hash.update(chunk)
+        total += len(chunk)
+    return total
+
+
+async def save_upload(audio_file: UploadFile, audio_hash=None) -> str:
+    """
+    Guarda el audio subido en AUDIOS_DIR (SAVE_AUDIOS) o en un archivo temporal
+    y devuelve la ruta. El borrado de los temporales queda a cargo de remove_upload.
+    """
+    if SAVE_AUDIOS:
+        # monotonic_ns + sufijo aleatorio: único aunque lleguen subidas concurrentes en el mismo tick
+        safe_name = f"audio_{time.monotonic_ns()}_{secrets.token_hex(4)}_{os.path.basename(audio_file.filename or 'upload.wav')}"
+        dst_path = os.path.join(AUDIOS_DIR, safe_name)
+        try:
+            print(f"[audio] Guardando audio en: {dst_path}")
+            with open(dst_path, "wb") as f:
+                size = await write_upload(audio_file, f, audio_hash)
+            print(f"[audio] Guardado {size} bytes en {dst_path}")
+        except Exception as e:
+            print(f"[audio][error] No se pudo guardar el audio en {dst_path}: {e}")
+            raise HTTPException(status_code=500, detail=f"Error al guardar audio: {e}")
+        return dst_path
+    with tempfile.NamedTemporaryFile(delete=False, suffix=audio_file.filename or ".wav") as tmp_file:
+        await write_upload(audio_file, tmp_file, audio_hash)
+    return tmp_file.name
+
+
+def remove_upload(audio_path: Optional[str]):
+    """Borra el archivo temporal de un upload (no hace nada si SAVE_AUDIOS)."""
+    if SAVE_AUDIOS or not audio_path or not os.path.exists(audio_path):
+        return
+    try:
+        print(f"Limpiando archivo temporal: {audio_path}")
+        os.unlink(audio_path)
+    except Exception:
+        pass
+
+
+# -------------------------------
+# Modelos faster-whisper
+# -------------------------------
+model_cache: Dict[str, "WhisperModel"] = {}
+# get_model se llama desde hilos (asyncio.to_thread): evita cargar dos veces el mismo modelo
+model_cache_lock = threading.Lock()
+
+
+def get_model(model_size: str) -> "WhisperModel":
+    """
+    Carga un modelo en el caché si no existe y lo retorna.
+    """
+    model = model_cache.get(model_size)
+    if model is not None:
+        return model
+    with model_cache_lock:
+        return _load_model(model_size)
+
+
+def _load_model(model_size: str) -> "WhisperModel":
+    if WhisperModel is None:
+        raise HTTPException(status_code=500, detail="faster-whisper no está instalado")
+    if model_size not in model_cache:
+        print(f"Cargando modelo '{model_size}' en {COMPUTE_DEVICE}...")
+        try:
+            model = WhisperModel(
+                model_size,
+                device=COMPUTE_DEVICE,
+                compute_type=COMPUTE_TYPE,
+                device_index=DEVICE_INDEX,
+                cpu_threads=CPU_THREADS,
+                num_workers=NUM_WORKERS,
+                download_root=MODELS_DIR
+            )
+            model_cache[model_size] = model
+            print(f"Modelo '{model_size}' cargado y listo.")
+        except Exception as e:
+            raise HTTPException(
+                status_code=500,
+                detail=f"Error al cargar el modelo {model_size}: {e}"
+            )
+    return model_cache[model_size]
+
+
+async def get_model_async(model_size: str) -> "WhisperModel":
+    """
+    Como get_model, pero si el modelo no está en caché lo carga en un hilo
+    para no congelar el event loop (y el resto de endpoints) durante la carga.
+    """
+    model = model_cache.get(model_size)
+    if model is None:
+        model = await asyncio.to_thread(get_model, model_size)
+    return model
+
+
+# Semáforo por modelo: cada WhisperModel ya reparte CPU_THREADS hilos por
+# worker de CT2, así que como mucho NUM_WORKERS transcripciones a la vez sobre
+# el mismo modelo (1 por defecto en CPU); el resto espera en lugar de sobresuscribir.
+model_locks: Dict[str, asyncio.Semaphore] = {}
+
+
+def get_model_lock(model_size: str) -> asyncio.Semaphore:
+    return model_locks.setdefault(model_size, asyncio.Semaphore(NUM_WORKERS))
+
+
+def warmup_model(model_size: str):
+    """
+    Carga el modelo y ejecuta una transcripción de 1 s de silencio para que
+    CTranslate2 haga la selección de kernels antes de la primera petición.
+    """
+    model = get_model(model_size)
+    segments, _ = model.transcribe(np.zeros(16000, dtype=np.float32), beam_size=1, vad_filter=False)
+    for _ in segments:  # el decodificado ocurre al iterar
+        pass
+    print(f"Modelo '{model_size}' precalentado.")
+
+
+# -------------------------------
+# Audio y transcripción
+# -------------------------------
+def load_audio(audio_path: str, audio_key: Optional[str] = None):
+    """
+    Decodifica wav/flac a float32 mono 16 kHz para pasar el array directamente a
+    model.transcribe. Si no es posible (otro formato, falta soundfile/resampy)
+    devuelve la ruta y faster-whisper decodifica el archivo como antes.
+    Con audio_key (hash del contenido) reutiliza/guarda la caché .f32.npy; los
+    WAV PCM16 16 kHz no se cachean porque el mmap ya es tan rápido como la caché.
+    """
+    if audio_path.lower().endswith(".wav"):
+        audio = _try_mmap_wav(audio_path)
+        if audio is not None:
+            return audio
+    cache_path = None
+    if CACHE_WAVEFORMS and audio_key:
+        cache_path = os.path.join(AUDIOS_DIR, f"{audio_key}.f32.npy")
+        if os.path.exists(cache_path):
+            try:
+                return np.load(cache_path, mmap_mode="r")
+            except Exception as e:
+                print(f"[audio] Caché inválida {cache_path}: {e}")
+    audio = _decode_audio(audio_path)
+    if cache_path and not isinstance(audio, str):
+        _save_waveform(cache_path, audio)
+    return audio
+
+
+def _save_waveform(cache_path: str, audio: np.ndarray):
+    # Escritura atómica: una petición concurrente nunca abre un .npy a medias
+    tmp_path = f"{cache_path}.{secrets.token_hex(4)}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            np.save(f, audio)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        print(f"[audio] No se pudo guardar la caché {cache_path}: {e}")
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+
+
+# Cabecera WAV canónica (la que escribe Recorder.js): RIFF/WAVE + fmt de 16 bytes + data
+WAV_HEADER = struct.Struct("<4sI4s4sIHHIIHH4sI")
+WAV_HEADER_SIZE = WAV_HEADER.size  # 44
+
+
+def _try_mmap_wav(audio_path: str) -> Optional[np.ndarray]:
+    """
+    Si el archivo es un WAV PCM16 mono 16 kHz con cabecera de 44 bytes, mapea
+    las muestras con np.memmap y las convierte a float32 en una sola operación.
+    Devuelve None para cualquier otra disposición.
+    """
+    try:
+        with open(audio_path, "rb") as f:
+            header = f.read(WAV_HEADER_SIZE)
+        if len(header) < WAV_HEADER_SIZE:
+            return None
+        (riff, _, wave, fmt, fmt_size, audio_format, channels, sample_rate,
+         _, _, bits, data_id, data_size) = WAV_HEADER.unpack(header)
+        if (riff, wave, fmt, data_id) != (b"RIFF", b"WAVE", b"fmt ", b"data"):
+            return None
+        if (fmt_size, audio_format, channels, sample_rate, bits) != (16, 1, 1, WHISPER_SAMPLE_RATE, 16):
+            return None
+        # data_size puede venir a 0/0xFFFFFFFF en WAV escritos en streaming: se limita al archivo
+        count = min(data_size, os.path.getsize(audio_path) - WAV_HEADER_SIZE) // 2
+        if count <= 0:
+            return None
+        samples = np.memmap(audio_path, dtype="<i2", mode="r", offset=WAV_HEADER_SIZE, shape=(count,))
+    except (OSError, ValueError, struct.error):
+        return None
+    audio = np.array(samples, dtype=np.float32)
+    audio *= 1.0 / 32768.0
+    return audio
+
+
+def _decode_audio(audio_path: str):
+    if sf is None or not audio_path.lower().endswith(DIRECT_DECODE_EXTS):
+        return audio_path
+    try:
+        audio, sr = sf.read(audio_path, dtype="float32", always_2d=False)
+    except Exception as e:
+        print(f"[audio] soundfile no pudo leer {audio_path}: {e}")
+        return audio_path
+    if audio.ndim == 2:
+        audio = audio.mean(axis=1)
+    if sr != WHISPER_SAMPLE_RATE:
+        if resampy is None:
+            return audio_path
+        audio = resampy.resample(audio, sr, WHISPER_SAMPLE_RATE)
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+
+@functools.lru_cache(maxsize=64)
+def transcribe_kwargs_for(language: str, beam_size: int) -> Mapping[str, Any]:
+    """
+    kwargs de model.transcribe para (idioma, beam_size), calculados una vez.
+    "" o "auto" detectan el idioma y, como "en", traducen al inglés; el resto transcribe.
+    Se devuelve de solo lectura porque el mismo objeto se comparte entre peticiones.
+    """
+    is_auto_detect = (language == "auto" or language == "")
+    task = "translate" if (is_auto_detect or language == "en") else "transcribe"
+    transcribe_kwargs = {**TRANSCRIBE_OPTIONS, 'task': task, 'beam_size': beam_size}
+    if not is_auto_detect:
+        transcribe_kwargs['language'] = language
+    return MappingProxyType(transcribe_kwargs)
+
+
+def transcribe_sync(model: "WhisperModel", audio_path: str, language: str,
+                    beam_size: int = DEFAULT_BEAM_SIZE, audio_key: Optional[str] = None) -> Tuple[str, Any]:
+    """
+    Ejecuta la transcripción completa y devuelve (texto, info). segments es un
+    generador perezoso: el decodificado ocurre al iterarlo. Pensada para correr en un hilo.
+    """
+    transcribe_kwargs = transcribe_kwargs_for(language, beam_size)
+    segments, info = model.transcribe(load_audio(audio_path, audio_key), **transcribe_kwargs)
+    # Un solo join al final; se descartan los segmentos vacíos o solo espacios que emite Whisper
+    parts = []
+    append = parts.append
+    for segment in segments:
+        text = segment.text
+        if text and not text.isspace():
+            append(text)
+    full_text = "".join(parts)
+    return full_text, info